@@ -1,106 +1,188 @@
 from flask import Flask, request, jsonify
-import urllib.request
-from html.parser import HTMLParser
+from flask_caching import Cache
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selectolax.lexbor import LexborHTMLParser
 from collections import Counter
 import re
-import json
+import orjson
 from urllib.parse import urlparse
-import matplotlib.pyplot as plt
 import io
 import base64
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
+app.json.compact = True
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 300})
+app.config['FETCH_MAX_BYTES'] = 5 * 1024 * 1024  # Hard ceiling on downloaded HTML
+app.config['FETCH_CHUNK_SIZE'] = 64 * 1024
+app.config['SEO_CONTENT_CAP'] = 50000  # Chars of body text fed to the text checks
+app.config['MIN_HTML_CHARS'] = 512  # Smaller bodies are error/redirect stubs, not pages
+fetch_pool = ThreadPoolExecutor(max_workers=8)  # Overlaps main/competitor page downloads
 
-class SEOParser(HTMLParser):
-    def __init__(self):
-        super().__init__()
+# Shared session: pooled keep-alive connections and compressed transfers
+session = requests.Session()
+session.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'SeoAuditAi/1.0'})
+_adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=Retry(total=2, backoff_factor=0.3))
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+_WORD_RE = re.compile(r'\w+')
+_SENT_RE = re.compile(r'[.!?]')
+_VOWEL_RE = re.compile(r'[aeiouy]+', re.I)
+_QUESTION_RE = re.compile(r'\s*(who|what|where|when|why|how)\b', re.I)
+# Raw-HTML markers for the mobile and AI-overview checks; only faq/summary ignore case
+_MARKER_RE = re.compile(r'name="viewport"|(?i:faq|summary)')
+_MARKERS = frozenset({'name="viewport"', 'faq', 'summary'})
+_HEAD_END_RE = re.compile(r'</head\s*>', re.I)
+# Any of these near the top marks a document as HTML; HTML5 allows omitting <html>/<body>
+_HTML_SNIFF_RE = re.compile(r'<(?:!doctype\s+html|html|head|body|title)\b', re.I)
+_STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have',
+    'he', 'her', 'his', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'not', 'of',
+    'on', 'or', 'our', 'she', 'so', 'that', 'the', 'their', 'them', 'they', 'this', 'to',
+    'was', 'we', 'were', 'will', 'with', 'you', 'your',
+})
+
+class SEOParser:
+    def __init__(self, head_only=False):
+        # head_only parses up to </head> and takes content from title/meta tags
+        self.head_only = head_only
         self.title = None
         self.meta_desc = None
         self.headings = {'h1': [], 'h2': [], 'h3': []}
         self.images_without_alt = 0
         self.links = {'internal': 0, 'external': 0, 'broken': []}  # Basic count
-        self.content_text = []
+        self.content_text = ''
         self.schema_found = False
         self.video_embeds = 0
-        self.current_tag = None
-
-    def handle_starttag(self, tag, attrs):
-        attrs_dict = dict(attrs)
-        if tag == 'title':
-            self.current_tag = 'title'
-        elif tag == 'meta' and attrs_dict.get('name') == 'description':
-            self.meta_desc = attrs_dict.get('content')
-        elif tag in ['h1', 'h2', 'h3']:
-            self.current_tag = tag
-        elif tag == 'img':
-            if 'alt' not in attrs_dict or not attrs_dict['alt'].strip():
+        self.meta_keywords = None
+        self.head_text = ''
+
+    def feed(self, html):
+        if self.head_only:
+            head_end = _HEAD_END_RE.search(html)
+            if head_end:
+                html = html[:head_end.end()]
+        tree = LexborHTMLParser(html)
+        title = tree.css_first('title')
+        if title is not None:
+            self.title = title.text(strip=True)
+        meta = tree.css_first('meta[name="description"]')
+        if meta is not None:
+            self.meta_desc = meta.attributes.get('content')
+        keywords_meta = tree.css_first('meta[name="keywords"]')
+        if keywords_meta is not None:
+            self.meta_keywords = keywords_meta.attributes.get('content')
+        # Title and meta text, the only content a head-only audit has
+        self.head_text = ' '.join(filter(None, [self.title, self.meta_desc, self.meta_keywords]))
+        if self.head_only:
+            # Body-derived fields are not measured, so report them as unknown
+            self.headings = self.links = None
+            self.images_without_alt = self.schema_found = self.video_embeds = None
+            self.content_text = self.head_text
+            return
+        for tag in self.headings:
+            self.headings[tag] = [node.text(separator=' ', strip=True) for node in tree.css(tag)]
+        for img in tree.css('img'):
+            alt = img.attributes.get('alt')
+            if not alt or not alt.strip():
                 self.images_without_alt += 1
-        elif tag == 'a':
-            href = attrs_dict.get('href')
+        for a in tree.css('a[href]'):
+            href = a.attributes.get('href')
             if href:
                 if href.startswith('http'):
                     self.links['external'] += 1
                 else:
                     self.links['internal'] += 1
-        elif tag == 'script' and attrs_dict.get('type') == 'application/ld+json':
-            self.schema_found = True
-        elif tag == 'video' or (tag == 'iframe' and 'youtube' in attrs_dict.get('src', '').lower()):
-            self.video_embeds += 1
-
-    def handle_data(self, data):
-        if self.current_tag == 'title':
-            self.title = data.strip()
-        elif self.current_tag in ['h1', 'h2', 'h3']:
-            self.headings[self.current_tag].append(data.strip())
-        else:
-            cleaned = data.strip()
-            if cleaned:
-                self.content_text.append(cleaned)
-
-    def handle_endtag(self, tag):
-        self.current_tag = None
+        self.schema_found = tree.css_first('script[type="application/ld+json"]') is not None
+        self.video_embeds = sum(
+            1 for node in tree.css('video, iframe[src]')
+            if node.tag == 'video' or 'youtube' in (node.attributes.get('src') or '').lower()
+        )
+        # Script/style bodies are not page content
+        tree.strip_tags(['script', 'style', 'noscript'])
+        if tree.body is not None:
+            # Text nodes are stripped inside the C extractor, so indentation and
+            # blank runs between tags never reach the analysis helpers
+            self.content_text = tree.body.text(separator=' ', strip=True)
 
 def fetch_page(url):
     try:
-        with urllib.request.urlopen(url) as response:
-            if response.code != 200:
-                return None, f"HTTP Error {response.code}"
-            html = response.read().decode('utf-8')
+        with session.get(url, timeout=(5, 15), stream=True) as response:
+            if response.status_code != 200:
+                return None, f"HTTP Error {response.status_code}"
+            max_bytes = app.config['FETCH_MAX_BYTES']
+            buf = bytearray()
+            for chunk in response.iter_content(app.config['FETCH_CHUNK_SIZE']):
+                # Look back a few bytes so a tag split across chunks is still seen
+                search_from = max(0, len(buf) - 6)
+                buf += chunk
+                if len(buf) >= max_bytes or buf.find(b'</body>', search_from) != -1:
+                    break
+            # requests reports ISO-8859-1 for any text/* without a charset, so only
+            # trust response.encoding when the server actually declared one
+            declared = 'charset' in response.headers.get('Content-Type', '').lower()
+            encoding = (response.encoding if declared else None) or 'utf-8'
+            try:
+                html = buf[:max_bytes].decode(encoding, 'replace')
+            except LookupError:
+                html = buf[:max_bytes].decode('utf-8', 'replace')
             return html, None
     except Exception as e:
         return None, str(e)
 
-def calculate_keyword_density(text):
-    words = re.findall(r'\w+', text.lower())
-    if not words:
+def tokenize(text):
+    # Shared by the keyword, readability and voice-search checks
+    return _WORD_RE.findall(text), _SENT_RE.split(text)
+
+def calculate_keyword_density(words, top_n=10):
+    # Keyword candidates are alphabetic tokens of two or more letters, lowercased per token
+    counter = Counter(word.lower() for word in words if len(word) > 1 and word.isalpha())
+    total = sum(counter.values())
+    if not total:
         return {}
-    counter = Counter(words)
-    total = len(words)
-    return {word: count / total * 100 for word, count in counter.most_common(10)}
+    # Stopwords still count towards the total but are never reported as keywords
+    for word in _STOPWORDS:
+        counter.pop(word, None)
+    scale = 100.0 / total
+    return {word: count * scale for word, count in counter.most_common(top_n)}
 
 def check_https(url):
     return urlparse(url).scheme == 'https'
 
-def check_mobile_friendly(html):
-    return 'name="viewport"' in html
+def find_markers(html):
+    # One pass over the raw HTML for every marker, stopping once all have been seen
+    found = set()
+    for m in _MARKER_RE.finditer(html):
+        found.add(m.group().lower())
+        if len(found) == len(_MARKERS):
+            break
+    return found
+
+def check_mobile_friendly(markers):
+    return 'name="viewport"' in markers
 
-def check_readability(text):
-    words = len(re.findall(r'\w+', text))
-    sentences = len(re.split(r'[.!?]', text))
-    syllables = sum(len(re.findall(r'[aeiouy]+', word, re.I)) for word in text.split())
+def check_readability(words, sentences, text):
+    words = len(words)
+    sentences = len(sentences)
+    # Vowel groups never span whitespace, so one scan of the whole text
+    # matches counting them word by word
+    syllables = sum(1 for _ in _VOWEL_RE.finditer(text))
     if words == 0 or sentences == 0:
         return 0
     asl = words / sentences
     asw = syllables / words
     return 206.835 - 1.015 * asl - 84.6 * asw
 
-def check_voice_search(text):
-    question_words = ['who', 'what', 'where', 'when', 'why', 'how']
-    questions = sum(1 for sentence in re.split(r'[.!?]', text) if any(sentence.lower().startswith(word) for word in question_words))
+def check_voice_search(sentences):
+    questions = sum(1 for sentence in sentences if _QUESTION_RE.match(sentence))
     return questions > 0, questions
 
-def check_ai_overview_potential(html):
-    return 'faq' in html.lower() or 'summary' in html.lower()
+def check_ai_overview_potential(markers):
+    return 'faq' in markers or 'summary' in markers
 
 def check_backlink_toxicity(links):
     return links['external'] > 10
@@ -117,7 +199,7 @@ def generate_content_suggestions(keywords, title, meta, headings, issues):
     if not meta:
         suggestions.append("Add meta description with keywords.")
         priorities.append("High impact: Boosts CTR by 20-40%.")
-    if not headings['h1']:
+    if headings is not None and not headings['h1']:
         suggestions.append("Add at least one H1 heading.")
         priorities.append("High impact: Enhances on-page structure for crawlers.")
     primary_kw = max(keywords, key=keywords.get) if keywords else ''
@@ -137,54 +219,82 @@ def calculate_health_score(issues):
     return score
 
 def generate_diagram(issues):
+    return _diagram_png(len(issues.get('critical', [])), len(issues.get('warning', [])), len(issues.get('info', [])))
+
+_plt = None
+
+def _pyplot():
+    # matplotlib is imported on first render so workers that never draw skip its cost
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use('Agg')  # Headless workers never need a GUI backend
+        import matplotlib.pyplot as plt
+        _plt = plt
+    return _plt
+
+@functools.lru_cache(maxsize=256)
+def _diagram_png(critical, warning, info):
+    # Issue counts are small, so a handful of renders covers nearly every audit
     categories = ['Critical', 'Warning', 'Info']
-    counts = [len(issues.get('critical', [])), len(issues.get('warning', [])), len(issues.get('info', []))]
+    counts = [critical, warning, info]
+    plt = _pyplot()
     fig, ax = plt.subplots()
     ax.pie(counts, labels=categories, autopct='%1.1f%%', startangle=90)
     ax.axis('equal')
     buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
     return f"data:image/png;base64,{img_base64}"
 
 def generate_report(results):
-    return json.dumps(results, indent=4)
+    return orjson.dumps(results, option=orjson.OPT_INDENT_2).decode('utf-8')
 
-def analyze_site(url, is_competitor=False):
-    html, error = fetch_page(url)
-    if error:
-        return None, error
-    parser = SEOParser()
+def analyze_html(html, url, is_competitor=False):
+    # Bail out before parsing, scoring and drawing anything for degenerate bodies
+    if len(html) < app.config['MIN_HTML_CHARS'] or not _HTML_SNIFF_RE.search(html, 0, 4096):
+        return None, None, 'Page too small or not HTML'
+    # Competitor comparisons only use the score and keywords, so skip the body
+    parser = SEOParser(head_only=is_competitor)
     parser.feed(html)
-    content = ' '.join(parser.content_text)
-    keywords = calculate_keyword_density(content)
+    # On-page signals come from the opening text; the tail only adds work
+    content = parser.content_text[:app.config['SEO_CONTENT_CAP']]
+    words, sentences = tokenize(content)
+    keywords = calculate_keyword_density(words)
     https = check_https(url)
-    mobile = check_mobile_friendly(html)
-    readability = check_readability(content)
-    voice_ready, questions = check_voice_search(content)
-    ai_potential = check_ai_overview_potential(html)
-    backlink_toxic = check_backlink_toxicity(parser.links)
+    markers = find_markers(html)
+    mobile = check_mobile_friendly(markers)
+    ai_potential = check_ai_overview_potential(markers)
     issues = {'critical': [], 'warning': [], 'info': []}
     if not https:
         issues['critical'].append('Site not using HTTPS')
     if not mobile:
         issues['warning'].append('No viewport meta for mobile')
-    if parser.images_without_alt > 0:
-        issues['warning'].append(f'{parser.images_without_alt} images without alt text')
-    if not parser.schema_found:
-        issues['info'].append('No schema markup found')
-    if parser.video_embeds == 0:
-        issues['info'].append('No video content detected')
-    if readability < 60:
-        issues['warning'].append('Content readability low')
-    if not voice_ready:
-        issues['info'].append('No question-based content for voice search')
     if not ai_potential:
         issues['info'].append('Limited potential for AI overviews')
-    if backlink_toxic:
-        issues['warning'].append('Potential toxic backlinks (too many externals)')
+    # Score and keywords from what a head-only audit also sees, for like-for-like comparison
+    head = {
+        'health_score': calculate_health_score(issues),
+        'keyword_density': keywords if parser.head_only else calculate_keyword_density(tokenize(parser.head_text)[0]),
+    }
+    readability = voice_ready = questions = backlink_toxic = None
+    if not parser.head_only:
+        readability = check_readability(words, sentences, content)
+        voice_ready, questions = check_voice_search(sentences)
+        backlink_toxic = check_backlink_toxicity(parser.links)
+        if parser.images_without_alt > 0:
+            issues['warning'].append(f'{parser.images_without_alt} images without alt text')
+        if not parser.schema_found:
+            issues['info'].append('No schema markup found')
+        if parser.video_embeds == 0:
+            issues['info'].append('No video content detected')
+        if readability < 60:
+            issues['warning'].append('Content readability low')
+        if not voice_ready:
+            issues['info'].append('No question-based content for voice search')
+        if backlink_toxic:
+            issues['warning'].append('Potential toxic backlinks (too many externals)')
     score = calculate_health_score(issues)
     content_sugs, priorities = generate_content_suggestions(keywords, parser.title, parser.meta_desc, parser.headings, issues)
     diagram = generate_diagram(issues) if not is_competitor else None  # Only for main site
@@ -211,7 +321,7 @@ def analyze_site(url, is_competitor=False):
     }
     if diagram:
         result['issues_diagram'] = diagram
-    return result, None
+    return result, head, None
 
 # --- BEGIN: Fix: Home route for GET / ---
 
@@ -230,39 +340,67 @@ def audit():
     data = request.json
     url = data.get('url')
     competitor_url = data.get('competitor_url')
+    # The pretty-printed report duplicates the whole response, so it is opt-in
+    include_report = request.args.get('include_report') == '1'
     if not url:
         return jsonify({'error': 'URL required'}), 400
 
-    main_result, main_error = analyze_site(url)
+    # Repeat audits of the same pair are served from the stored JSON body
+    cache_key = f"audit:{url}|{competitor_url or ''}|{int(include_report)}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return app.response_class(cached, mimetype='application/json')
+
+    # Download both pages at once; parsing stays on the request thread
+    main_fetch = fetch_pool.submit(fetch_page, url)
+    comp_fetch = fetch_pool.submit(fetch_page, competitor_url) if competitor_url else None
+
+    main_html, main_error = main_fetch.result()
     if main_error:
         return jsonify({'error': main_error}), 500
+    main_result, main_head, main_error = analyze_html(main_html, url)
+    if main_error:
+        # The fetch succeeded but the page can't be audited; not a server fault
+        return jsonify({'error': main_error}), 422
 
     competitor_result = None
-    if competitor_url:
-        competitor_result, comp_error = analyze_site(competitor_url, is_competitor=True)
+    if comp_fetch:
+        comp_html, comp_error = comp_fetch.result()
+        if not comp_error:
+            competitor_result, comp_head, comp_error = analyze_html(comp_html, competitor_url, is_competitor=True)
         if comp_error:
             main_result['competitor_error'] = comp_error
         else:
             # Simple comparison
             comp = {
-                'health_score_diff': main_result['health_score'] - competitor_result['health_score'],
-                'keyword_overlap': list(set(main_result['keyword_density'].keys()) & set(competitor_result['keyword_density'].keys())),
+                # The competitor is audited from <head> only, so compare on the same checks
+                'health_score_diff': main_head['health_score'] - comp_head['health_score'],
+                'keyword_overlap': list(main_head['keyword_density'].keys() & comp_head['keyword_density'].keys()),
+                'competitor_scope': ("Competitor parsed from <head> only: keywords come from the title and meta tags, "
+                                     "body checks (headings, images, links, video, schema, readability, voice search) "
+                                     "are not measured. health_score_diff covers only HTTPS, mobile viewport and "
+                                     "AI-overview checks, and keyword_overlap compares title/meta keywords of both sites."),
                 'suggestions': []
             }
             if comp['health_score_diff'] < 0:
-                comp['suggestions'].append("Your score is lower; focus on matching competitor's strong areas like headings.")
+                comp['suggestions'].append("Your score is lower; focus on matching competitor's strong areas like HTTPS, a mobile viewport and FAQ/summary content.")
             main_result['competitor_analysis'] = comp
             main_result['competitor_details'] = competitor_result
 
     main_result['url'] = url
-    main_result['report'] = generate_report(main_result)
+    if include_report:
+        main_result['report'] = generate_report(main_result)
     main_result['quick_fixes'] = [
         {"fix": "Optimize meta descriptions and titles", "price": 4.99, "impact": "Immediate CTR boost"},
         {"fix": "Add alt text to images", "price": 4.99, "impact": "Better image SEO"},
         {"fix": "Improve H1/H2 structure", "price": 4.99, "impact": "Enhanced on-page ranking"}
     ]  # Simulate buy option
 
-    return jsonify(main_result)
+    body = orjson.dumps(main_result)
+    # A failed competitor fetch may be transient, so don't pin it for the cache timeout
+    if 'competitor_error' not in main_result:
+        cache.set(cache_key, body)
+    return app.response_class(body, mimetype='application/json')
 
 if __name__ == '__main__':
     app.run(debug=True)